@@ -0,0 +1,19 @@
+"""Command line options for the tests in linter/.
+
+Options have to be registered by a conftest.py pytest loads at startup, so they live here.
+linter/conftest.py reads them with defaults, so the tests also run from inside linter/, without the options.
+"""
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--use-url-cache",
+        action="store_true",
+        help="Skip URLs that passed in a recent test run (see GOOD_URL_TTL in linter/rules/url.py).",
+    )
+    parser.addoption(
+        "--integration",
+        action="store_true",
+        help="Also run the tests marked as integration, which probe live third-party websites.",
+    )
+
@@ -5,8 +5,8 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-import copy
-import json
+import contextlib
+import functools
 import logging
 import os
 import sys
@@ -14,8 +14,10 @@ from collections.abc import Sequence
 from queue import Queue
 
 import colorlog
+import orjson
 from db import DatabaseConnection
 from lib import Session, single_tool_to_search_json
+from rules.url import close_session, load_good_urls, save_good_urls
 from utils import unflatten_json_from_single_dict
 
 REPORT = 15
@@ -27,11 +29,34 @@ def configure_logging(color: bool, log_level: str) -> None:
     Args:
     ----
         color (bool): Show colors or not
-        log_level (int): What level to log
+        log_level (str): What level to log
 
     """
     logging.addLevelName(REPORT, "REPORT")
     logging.basicConfig(level=log_level, force=True)
+    root_logger = logging.getLogger()
+    # Drop the handler basicConfig added, whatever else is attached to the root logger
+    root_logger.handlers.clear()
+    # The handler is made on every call so it writes to the current stderr
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(console_formatter(color, log_level))
+    root_logger.addHandler(console_handler)
+
+
+@functools.cache
+def console_formatter(color: bool, log_level: str) -> logging.Formatter:
+    """Build the console formatter for a logging configuration, it is built once per configuration and then reused.
+
+    Args:
+    ----
+        color (bool): Show colors or not
+        log_level (str): What level to log
+
+    Returns:
+    -------
+        logging.Formatter: Formatter of console messages
+
+    """
     if color:
         log_format = (
             "%(log_color)s%(asctime)s %(name)s %(levelname)s %(filename)s@%(lineno)d - %(message)s"
@@ -51,11 +76,6 @@ def configure_logging(color: bool, log_level: str) -> None:
             reset=True,
             style="%",
         )
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        root_logger = logging.getLogger()
-        root_logger.removeHandler(root_logger.handlers[0])
-        root_logger.addHandler(console_handler)
     else:
         log_format = (
             "%(asctime)s %(name)s %(levelname)s %(filename)s@%(lineno)d - %(message)s"
@@ -63,23 +83,34 @@ def configure_logging(color: bool, log_level: str) -> None:
             else "%(levelname)s%(message)s"
         )
         formatter = logging.Formatter(log_format)
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        root_logger = logging.getLogger()
-        root_logger.removeHandler(root_logger.handlers[0])
-        root_logger.addHandler(console_handler)
+    return formatter
 
 
-def parse_arguments(arguments: Sequence[str]) -> argparse.Namespace:
-    """Parse CLI arguments. Hard exits when arguments are not valid.
+def export_messages(db: DatabaseConnection, message_queue: Queue) -> bool:
+    """Insert the messages of a finished batch into the database and commit them.
 
     Args:
     ----
-        arguments (Sequence[str]): Input argument sequence
+        db (DatabaseConnection): Database to write to
+        message_queue (Queue): Messages of the batch, emptied as a side effect
 
     Returns:
     -------
-        argparse.Namespace: Output arguments
+        bool: True if any messages have been received
+
+    """
+    returned_at_least_one_value = db.insert_from_queue(message_queue)
+    db.commit()
+    return returned_at_least_one_value
+
+
+@functools.lru_cache(maxsize=1)
+def build_parser() -> argparse.ArgumentParser:
+    """Build the CLI argument parser, it is built once and reused as parsing doesn't change it.
+
+    Returns:
+    -------
+        argparse.ArgumentParser: Parser of the CLI arguments
 
     """
     parser = argparse.ArgumentParser(
@@ -136,6 +167,11 @@ def parse_arguments(arguments: Sequence[str]) -> argparse.Namespace:
         action="store_true",
         help="Enable this option to make the program exit with error code 1 if any errors are encountered during execution.",
     )
+    parser.add_argument(
+        "--url-cache",
+        default=None,
+        help="File to remember URLs that passed in. URLs that passed in the last 24 hours are not checked again.",
+    )
     parser.add_argument(
         "--no-color",
         action="store_false",
@@ -147,7 +183,22 @@ def parse_arguments(arguments: Sequence[str]) -> argparse.Namespace:
         help="Profile code.",
     )
 
-    args = parser.parse_args(arguments)
+    return parser
+
+
+def parse_arguments(arguments: Sequence[str]) -> argparse.Namespace:
+    """Parse CLI arguments. Hard exits when arguments are not valid.
+
+    Args:
+    ----
+        arguments (Sequence[str]): Input argument sequence
+
+    Returns:
+    -------
+        argparse.Namespace: Output arguments
+
+    """
+    args = build_parser().parse_args(arguments)
 
     # Check for correct arguments
     # Require name or --lint-all
@@ -189,133 +240,150 @@ async def main(argv: Sequence[str]) -> int:
     # Configure logging
     configure_logging(args.no_color, args.log_level)
 
+    if args.url_cache is not None:
+        load_good_urls(args.url_cache)
+
     session = Session()
     db = DatabaseConnection(
         database_credentials, database_credentials is None or not database_credentials or database_credentials == "ignore")
-    message_queue = Queue()
-    returned_at_least_one_error: bool = False
-
-    # Start linting, switch modes
-    if args.json:
-        input_json = "\n".join(sys.stdin.readlines())
-        json_data = {"x": single_tool_to_search_json(json.loads(input_json))}
-        session = Session(json_data)
-
-        if session.get_total_tool_count() != 1:
-            logging.critical("Could not load JSON.")
-            return 1
-
-        for tool in session.return_tool_list_json():
-            name = tool["biotoolsID"]
-            if name is None:
+    # Messages of the last batch, written in a thread while the next one is linted
+    export: asyncio.Future[bool] | None = None
+    # The connections are closed and the URL cache saved however the run ends, early returns included
+    try:
+        message_queue = Queue()
+        returned_at_least_one_error: bool = False
+
+        # Start linting, switch modes
+        if args.json:
+            input_json = "\n".join(sys.stdin.readlines())
+            json_data = {"x": single_tool_to_search_json(orjson.loads(input_json))}
+            session = Session(json_data)
+
+            if session.get_total_tool_count() != 1:
                 logging.critical("Could not load JSON.")
                 return 1
-            db.drop_rows_with_tool_name(name)
-
-        await session.lint_all_tools(return_q=message_queue)
-        json_queue = Queue()
-        json_queue.queue = copy.deepcopy(message_queue.queue)
-        returned_at_least_one_error = db.insert_from_queue(message_queue)
-
-        json_list = []
-        while json_queue.qsize() != 0:
-            json_list.append(json_queue.get())
-        json_list = [x.__dict__ for x in json_list if x.code != "LINT-F"]
-
-        if args.biotools_format:
-            # Mimic the way the bio.tools validate API works
-            if json_list == []:
-                print(input_json)
-            else:
-                errors = {}
-                for error in json_list:
-                    slug = error['code']
-                    if slug in ["PMCID_BUT_NOT_DOI", "PMID_BUT_NOT_DOI", "DOI_BUT_NOT_PMCID", "DOI_BUT_NOT_PMID", "PMCID_BUT_NOT_PMID"]:
-                        slug = "PMID,_PMCID_and_DOI_conversion"
-                    if slug in ["PMID_DISCREPANCY", "PMCID_DISCREPANCY", "DOI_DISCREPANCY"]:
-                        slug = "PMID,_PMCID_and_DOI_discrepancy"
-                    error_docs_url = f"https://biotools-linter.biodata.ceitec.cz/docs#{slug}"
-                    errors.update(unflatten_json_from_single_dict(
-                        {error["location"].split("//")[1]: [f'{error["body"]} <a href="{error_docs_url}">More info.</a>']},
-                    ))
-
-                print(json.dumps(errors))
-        else:
-            print(json.dumps(json_list))
 
-        db.commit()
-
-    elif args.lint_all:
-        # Try to lint all tools on bio.tools
-        page = args.page if args.page else 1
-        processed_tools = 10 * (page - 1)
-
-        session.search_api("*", page)
-        count = session.json["*"]["count"]
-        logging.info(f"Linting {count} tools")
-
-        while session.next_page_exists() or page == 1:
-            # Dump cache so it doesn't OOM
-            session.clear_cache()
-
-            session.search_api_multiple_pages("*", page, page + 10)
-            processed_tools += 10
-            logging.info(
-                f"Page: {page} => {page + 10}, Progress: {processed_tools / count}%",
-            )
-
-            # Delete old entries from table
             for tool in session.return_tool_list_json():
                 name = tool["biotoolsID"]
+                if name is None:
+                    logging.critical("Could not load JSON.")
+                    return 1
                 db.drop_rows_with_tool_name(name)
 
             await session.lint_all_tools(return_q=message_queue)
-            page += 10
+            # Linting is done, so the messages can be read straight from the queue before the database empties it
+            json_list = [x.to_dict() for x in message_queue.queue if x.code != "LINT-F"]
             returned_at_least_one_error = db.insert_from_queue(message_queue)
 
-            db.commit()
-    else:
-        # Lint specific tools(s)
-        if args.name == "-":
-            # Pipe from stdin
-            for line in sys.stdin:
-                if line.strip() != "":
-                    session.search_api(line.strip(), args.page)
-        elif args.exact:
-            session.search_api_exact_match(args.name)
-        else:
-            session.search_api(args.name, args.page)
+            if args.biotools_format:
+                # Mimic the way the bio.tools validate API works
+                if json_list == []:
+                    print(input_json)
+                else:
+                    errors = {}
+                    for error in json_list:
+                        slug = error['code']
+                        if slug in ["PMCID_BUT_NOT_DOI", "PMID_BUT_NOT_DOI", "DOI_BUT_NOT_PMCID", "DOI_BUT_NOT_PMID", "PMCID_BUT_NOT_PMID"]:
+                            slug = "PMID,_PMCID_and_DOI_conversion"
+                        if slug in ["PMID_DISCREPANCY", "PMCID_DISCREPANCY", "DOI_DISCREPANCY"]:
+                            slug = "PMID,_PMCID_and_DOI_discrepancy"
+                        error_docs_url = f"https://biotools-linter.biodata.ceitec.cz/docs#{slug}"
+                        errors.update(unflatten_json_from_single_dict(
+                            {error["location"].split("//")[1]: [f'{error["body"]} <a href="{error_docs_url}">More info.</a>']},
+                        ))
+
+                    print(orjson.dumps(errors).decode())
+            else:
+                print(orjson.dumps(json_list).decode())
 
-        count = session.get_total_tool_count()
+            db.commit()
 
-        if count == 0:
-            logging.critical(f"Found {count} tools, exiting")
-            return 1
+        elif args.lint_all:
+            # Try to lint all tools on bio.tools
+            page = args.page if args.page else 1
+            processed_tools = 10 * (page - 1)
+
+            # Searches block, so they run in a thread to keep the event loop free (e.g. to cancel the run)
+            await asyncio.to_thread(session.search_api, "*", page)
+            count = session.json["*"]["count"]
+            logging.info(f"Linting {count} tools")
+
+            while session.next_page_exists() or page == 1:
+                # Dump cache so it doesn't OOM
+                session.clear_cache()
+
+                await asyncio.to_thread(session.search_api_multiple_pages, "*", page, page + 10)
+                processed_tools += 10
+                logging.info(
+                    f"Page: {page} => {page + 10}, Progress: {processed_tools / count}%",
+                )
+
+                # The previous batch is written while these pages are fetched, it has to finish before the table is touched again
+                if export is not None:
+                    returned_at_least_one_error |= await export
+
+                # Delete old entries from table
+                for tool in session.return_tool_list_json():
+                    name = tool["biotoolsID"]
+                    db.drop_rows_with_tool_name(name)
+
+                # Every batch gets its own queue, as the previous one may still be draining
+                message_queue = Queue()
+                await session.lint_all_tools(return_q=message_queue)
+                page += 10
+                export = asyncio.ensure_future(asyncio.to_thread(export_messages, db, message_queue))
+
+            if export is not None:
+                returned_at_least_one_error |= await export
+        else:
+            # Lint specific tools(s)
+            if args.name == "-":
+                # Pipe from stdin
+                for line in sys.stdin:
+                    if line.strip() != "":
+                        session.search_api(line.strip(), args.page)
+            elif args.exact:
+                session.search_api_exact_match(args.name)
+            else:
+                session.search_api(args.name, args.page)
 
-        logging.info(f"Found {count} tools")
+            count = session.get_total_tool_count()
 
-        # Delete old entries from table
-        for tool in session.return_tool_list_json():
-            name = tool["biotoolsID"]
-            db.drop_rows_with_tool_name(name)
+            if count == 0:
+                logging.critical(f"Found {count} tools, exiting")
+                return 1
 
-        await session.lint_all_tools(return_q=message_queue)
-        returned_at_least_one_error = db.insert_from_queue(message_queue)
+            logging.info(f"Found {count} tools")
 
-        db.commit()
+            # Delete old entries from table
+            for tool in session.return_tool_list_json():
+                name = tool["biotoolsID"]
+                db.drop_rows_with_tool_name(name)
 
-    db.close()
+            await session.lint_all_tools(return_q=message_queue)
+            returned_at_least_one_error = db.insert_from_queue(message_queue)
 
-    if session.next_page_exists():
-        logging.info(
-            f"You can also search the next page (page {int(args.page) + 1})")
-    if session.previous_page_exists():
-        logging.info(
-            f"You can also search the previous page (page {int(args.page) - 1})")
+            db.commit()
 
-    if returned_at_least_one_error and args.exit_on_error:
-        return 254
-    return 0
+        if session.next_page_exists():
+            logging.info(
+                f"You can also search the next page (page {int(args.page) + 1})")
+        if session.previous_page_exists():
+            logging.info(
+                f"You can also search the previous page (page {int(args.page) - 1})")
+
+        if returned_at_least_one_error and args.exit_on_error:
+            return 254
+        return 0
+    finally:
+        # The thread can't be stopped and is still using the connection, so let it finish first
+        if export is not None and not export.done():
+            with contextlib.suppress(Exception):
+                await export
+        db.close()
+        await close_session()
+        if args.url_cache is not None:
+            save_good_urls(args.url_cache)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+"""Shared pytest configuration."""
+
+import os
+
+import pytest
+import pytest_asyncio
+import rules.url as url
+from rules.url import close_session, load_good_urls, save_good_urls
+
+# Kept outside the repository's tracked files, see .gitignore
+URL_CACHE = os.path.join(".cache", "good_urls.json")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "integration: probes live third-party websites, needs --integration")
+
+
+def pytest_collection_modifyitems(config, items):
+    # The option is only registered when pytest runs from the repository root
+    if config.getoption("--integration", default=False):
+        return
+
+    skip = pytest.mark.skip(reason="needs --integration")
+    for item in items:
+        if "integration" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def url_cache(request):
+    """Load URLs that passed in earlier runs and save the ones that pass in this one."""
+    if not request.config.getoption("--use-url-cache", default=False):
+        yield
+        return
+
+    load_good_urls(URL_CACHE)
+    yield
+
+    # With pytest-xdist every worker saves, so merge with what other workers saved in the meantime
+    passed = url.recent_good
+    load_good_urls(URL_CACHE)
+    url.recent_good.update(passed)
+    os.makedirs(os.path.dirname(URL_CACHE), exist_ok=True)
+    save_good_urls(URL_CACHE)
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def url_session():
+    """Close the shared aiohttp session at the end of each test, while its event loop still runs."""
+    yield
+    await close_session()
@@ -1,6 +1,8 @@
+import csv
 import datetime
+import io
 import logging
-from queue import Queue
+from queue import Empty, Queue
 
 from message import Level, Message
 import psycopg2
@@ -30,10 +32,11 @@ class DatabaseConnection:
         if mock or creds is None:
             return
 
-        logging.info(f"Connecting to database {parse_dsn(creds)['dbname']}")
+        dsn = parse_dsn(creds)
+        logging.info(f"Connecting to database {dsn['dbname']}")
 
         # Connect
-        conn: psycopg2.extensions.connection = psycopg2.connect(**parse_dsn(creds))
+        conn: psycopg2.extensions.connection = psycopg2.connect(**dsn)
         cursor: psycopg2.extensions.cursor = conn.cursor()
 
         # Create table query
@@ -70,33 +73,41 @@ class DatabaseConnection:
             bool (bool): True if any messages have been received.
 
         """
-        if not self.mock:
-            logging.info("Sending messages to database")
+        if self.mock:
+            # Nothing is written, so it only has to find one message before dropping the rest
+            with queue.mutex:
+                returned_atleast_one_value = any(item.level != Level.LinterInternal for item in queue.queue)
+                queue.queue.clear()
+            return returned_atleast_one_value
+
+        logging.info("Sending messages to database")
 
         returned_atleast_one_value = False
+        now = int(datetime.datetime.now(tz=datetime.timezone.utc).timestamp())
+
+        # Rows are written as CSV and sent in one COPY instead of an INSERT per message
+        # Strings are quoted so empty ones aren't read as NULL
+        rows = io.StringIO()
+        writer = csv.writer(rows, quoting=csv.QUOTE_NONNUMERIC)
 
-        while not queue.empty():
-            item: Message = queue.get()
+        # Drained with get_nowait, checking empty() first would take the queue's lock twice per message
+        get = queue.get_nowait
+        while True:
+            try:
+                item: Message = get()
+            except Empty:
+                break
 
             if item.level == Level.LinterInternal:
                 continue
 
             returned_atleast_one_value = True
+            writer.writerow((now, item.tool, item.code, item.location, item.body, int(item.level)))
 
-            if self.mock:
-                continue
-
-            # Export
-            insert_query = "INSERT INTO messages (time, tool, code, location, text, level) VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING;"
-            data = (
-                int(datetime.datetime.now(tz=datetime.timezone.utc).timestamp()),
-                item.tool,
-                item.code,
-                item.location,
-                item.body,
-                int(item.level),
-            )
-            self.cursor.execute(insert_query, data)
+        if returned_atleast_one_value:
+            rows.seek(0)
+            copy_query = "COPY messages (time, tool, code, location, text, level) FROM STDIN WITH (FORMAT csv)"
+            self.cursor.copy_expert(copy_query, rows)
 
         return returned_atleast_one_value
 
@@ -6,17 +6,19 @@ import asyncio
 import logging
 import queue
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import ClassVar
 
+import orjson
 import requests
-from rules import url
 from message import Level, Message
 from requests.adapters import HTTPAdapter
 from rules import delegate_key_value_filter, delegate_whole_json_filter
 from urllib3.util.retry import Retry
 from utils import (
-    flatten_json_to_single_dict,
+    iterate_flattened_json,
     sanity_check_json,
     single_tool_to_search_json,
 )
@@ -25,8 +27,11 @@ REPORT: int = 15  # Report log level is between debug and info
 TIMEOUT = (
     60  # Custom timeout for biotools API, it's longer so it doesn't silently crash
 )
+# How many search pages are fetched at once
+PAGE_WORKERS = 8
+# Shared by every search so --lint-all doesn't start new threads for each batch of pages, threads start on first use
+page_executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix="page")
 retries = 5
-session = requests.Session()
 retry = Retry(
     total=retries,
     read=retries,
@@ -34,9 +39,22 @@ retry = Retry(
     backoff_factor=0.3,
     status_forcelist=(500, 502, 504),
 )
-adapter = HTTPAdapter(max_retries=retry)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
+# requests doesn't guarantee a Session is safe to share between threads, and pages are fetched by several,
+# so every thread gets its own pooled session, see `get_session`
+thread_local = threading.local()
+
+
+def get_session() -> requests.Session:
+    """Return the requests session of the current thread, created with the retry policy on first use."""
+    session = getattr(thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        thread_local.session = session
+
+    return session
 
 
 class Session:
@@ -105,9 +123,9 @@ class Session:
         url = f"https://bio.tools/api/t/?q={name}&format=json&page={page!s}"
 
         try:
-            response = requests.get(url, timeout=TIMEOUT)
+            response = get_session().get(url, timeout=TIMEOUT)
             if response.ok:
-                self.json[name] = response.json()
+                self.json[name] = orjson.loads(response.content)
                 return
 
             logging.error("Non 200 status code received from bio.tools API")
@@ -141,9 +159,9 @@ class Session:
         url = f"https://bio.tools/api/t/{name}?format=json"
 
         try:
-            response = session.get(url, timeout=TIMEOUT)
+            response = get_session().get(url, timeout=TIMEOUT)
             if response.ok:
-                json = response.json()
+                json = orjson.loads(response.content)
                 # Need to wrap it so its compatible with the rest of the code
                 json = single_tool_to_search_json(json)
                 self.json[name] = json
@@ -185,31 +203,42 @@ class Session:
         # Temporarily set to info to debug production crashes
         logging.info(f"Searching API for {name}")
 
-        for page in range(page_start, page_end):
-            url = f"https://bio.tools/api/t/?q={name}&format=json&page={page!s}"
-
-            try:
-                response = session.get(url, timeout=TIMEOUT)
-                if (
-                    "detail" in response.json()
-                    and response.json()["detail"]
-                    == "Invalid page. That page contains no results."
-                ):
-                    logging.warning(f"Page {page} doesn't exist, ending search")
-                    continue
-
-                if response.ok:
-                    # To avoid overwriting the entire dictionary it just adds the page number to the end to make it unique
-                    self.json[f"{name}{page}"] = response.json()
-                    continue
-
-                logging.error(
-                    f"Non 200 status code received from bio.tools API: {response.status_code}",
-                )
-            except Exception as e:
-                logging.exception(
-                    f"Error while trying to contact the bio.tools API:\n{e}",
-                )
+        # Pages are fetched in parallel, then added in order
+        pages = range(page_start, page_end)
+        results = list(page_executor.map(lambda page: self._fetch_page(name, page), pages))
+
+        for page, result in zip(pages, results, strict=True):
+            if result is not None:
+                # To avoid overwriting the entire dictionary it just adds the page number to the end to make it unique
+                self.json[f"{name}{page}"] = result
+
+    def _fetch_page(self: Session, name: str, page: int) -> dict | None:
+        """Fetch one page of search results, returns None if it doesn't exist or the request failed."""
+        url = f"https://bio.tools/api/t/?q={name}&format=json&page={page!s}"
+
+        try:
+            response = get_session().get(url, timeout=TIMEOUT)
+            response_json = orjson.loads(response.content)
+            if (
+                "detail" in response_json
+                and response_json["detail"]
+                == "Invalid page. That page contains no results."
+            ):
+                logging.warning(f"Page {page} doesn't exist, ending search")
+                return None
+
+            if response.ok:
+                return response_json
+
+            logging.error(
+                f"Non 200 status code received from bio.tools API: {response.status_code}",
+            )
+        except Exception as e:
+            logging.exception(
+                f"Error while trying to contact the bio.tools API:\n{e}",
+            )
+
+        return None
 
     def return_tool_list_json(self: Session) -> list:
         """Return JSON of all tools currently cached.
@@ -264,11 +293,11 @@ class Session:
         )
         logging.debug(f"Tool {tool_name} returned {len(data_json)} JSON keys")
 
-        dictionary = flatten_json_to_single_dict(data_json, parent_key=tool_name + "/")
-
         # Put key value filters and whole json filters into queue
+        # The pairs are consumed as they are flattened, the flat dict is never built
         futures = [
-            delegate_key_value_filter(key, value) for key, value in dictionary.items()
+            delegate_key_value_filter(key, value)
+            for key, value in iterate_flattened_json(data_json, parent_key=tool_name + "/")
         ] + [delegate_whole_json_filter(data_json)]
 
         for f in asyncio.as_completed(futures):
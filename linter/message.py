@@ -27,6 +27,9 @@ class Message:
 
     """Message returned by the linter upwards to lib and cli."""
 
+    # A full run creates a lot of these, slots keep them small
+    __slots__ = ("body", "code", "level", "location", "tool")
+
     tool: str  # Tool (biotools id) will be filled-in in lib/lint_specific_tool
     level: Level
     code: str
@@ -47,6 +50,16 @@ class Message:
         self.location = location
         self.tool = None
 
+    def to_dict(self: Message) -> dict:
+        """Return the message as a JSON serializable dict."""
+        return {
+            "code": self.code,
+            "body": self.body,
+            "level": self.level,
+            "location": self.location,
+            "tool": self.tool,
+        }
+
     def print_message(self: Message, message_queue: None | queue.Queue = None) -> str:
         """Print the message as a report, and put it into the message queue. Returns outputed string."""
         message = f"{self.tool} [{self.code}]: {self.body}"
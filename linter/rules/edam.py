@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import csv
+import functools
 import logging
 import os
 import sys
@@ -10,7 +11,6 @@ import sys
 import owlready2
 import requests
 from message import Level, Message
-from utils import flatten_json_to_single_dict
 
 
 class EdamFilter:
@@ -276,18 +276,17 @@ class EdamFilter:
         logging.debug("checking EDAM")
         reports = []
 
-        pairs = flatten_json_to_single_dict(json, parent_key=json["name"] + "/")
-
         if not 'function' in json or not json['function']:
             return None
 
         # Check for specific attributes in EDAM classes that are not present in
         # the tools annotations, e.g. It has EDAM.operation_2403 which has topic EDAM.topic_0080
         # however that is not present in the tools topics
-        for function in json['function']:
-            for operation in function['operation']:
+        for function_index, function in enumerate(json['function']):
+            for operation_index, operation in enumerate(function['operation']):
                 edam_class = self.get_class_from_uri(operation['uri'])
-                location = [(x,y) for (x,y) in pairs.items() if y == operation['uri']][0][0]
+                # Same key as flatten_json_to_single_dict would give the URI
+                location = f"{json['name']}//function/{function_index}/operation/{operation_index}/uri"
                 if edam_class:
                     if "topic" in json:
                         reports.extend(self.check_topics(edam_class, json["topic"], location))
@@ -299,4 +298,10 @@ class EdamFilter:
         return reports
 
 
-edam_filter = EdamFilter()
+@functools.lru_cache(maxsize=1)
+def get_edam_filter() -> EdamFilter:
+    """Return the shared EDAM filter, the ontology is only parsed on the first call."""
+    return EdamFilter()
+
+
+edam_filter = get_edam_filter()
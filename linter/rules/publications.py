@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import asyncio
 import logging
+import os
 from dataclasses import dataclass
 from typing import Optional
 
@@ -11,13 +12,23 @@ from cacheout import Cache
 from message import Level, Message
 from utils import array_without_value
 
-from .url import client_args
+from .url import get_session
 
 cache: Cache = Cache(maxsize=8192, ttl=0, default=None)
-
+# The lookups are bound to the event loop they run in, see `get_in_flight`
+in_flight: dict[str, asyncio.Future] = {}
+in_flight_loop: asyncio.AbstractEventLoop | None = None
+# Batch requests still running, the event loop only keeps weak references to tasks
+batches: set[asyncio.Task] = set()
+
+# NCBI allows 10 instead of 3 requests per second with an API key
+API_KEY = os.environ.get("NCBI_API_KEY")
 # allow for 100 concurrent entries within a 60 second window
 # NCBI recommends a maximum of 3 requests per second
-rate_limit = AsyncLimiter(160, 60)
+rate_limit = AsyncLimiter(540 if API_KEY else 160, 60)
+# The ID converter accepts up to 200 IDs per request
+BATCH_SIZE = 200
+IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
 
 TYPES = ["doi", "pmid", "pmcid"]
 
@@ -39,6 +50,11 @@ async def filter_pub(json: dict) -> list[Message] | None:
     if "publication" not in json or not json["publication"]:
         return None
 
+    # Convert every ID up front, batched by type, so the checks below are served from the cache
+    await PublicationData.convert_many([
+        publication.get(kind) for publication in json["publication"] for kind in TYPES
+    ])
+
     tasks = [process_publication(json, pub_index, publication) for pub_index, publication in enumerate(json["publication"])]
     results = await asyncio.gather(*tasks)
     messages = [message for result in results for message in result if result]
@@ -158,51 +174,201 @@ class PublicationData:
     @staticmethod
     async def convert(identifier: str) -> PublicationData | None:
         """Convert a given identifier (DOI, PMID, or PMCID) to the other formats."""
-        if identifier in cache:
-            return cache.get(identifier)
-        
         if identifier is None or identifier == "None" or identifier == "":
             return None
 
+        # Unknown identifiers are cached as None too, only request errors are retried
+        if identifier in cache:
+            return cache.get(identifier)
+
+        # Publications are shared between tools and each one is converted once per ID type,
+        # so concurrent lookups of the same identifier wait for the one already in flight
+        running = get_in_flight()
+        task = running.get(identifier)
+        if task is None:
+            task = asyncio.ensure_future(PublicationData.request(identifier))
+            running[identifier] = task
+            task.add_done_callback(lambda _: running.pop(identifier, None))
+
+        # Shielded so a cancelled caller doesn't cancel the lookup for everyone else
+        return await asyncio.shield(task)
+
+    @staticmethod
+    async def convert_many(identifiers: list[str | None]) -> list[PublicationData | None]:
+        """Convert several identifiers, identifiers of the same type share one request per `BATCH_SIZE`.
+
+        Returns the conversions in the order of `identifiers`, like calling `convert` on each.
+        """
+        running = get_in_flight()
+        pending = {
+            identifier for identifier in identifiers
+            if identifier not in (None, "None", "") and identifier not in cache and identifier not in running
+        }
+
+        # The ID converter only accepts one type of ID per request
+        groups: dict[str, list[str]] = {}
+        for identifier in pending:
+            groups.setdefault(id_type(identifier), []).append(identifier)
+
+        loop = asyncio.get_running_loop()
+        for group in groups.values():
+            for start in range(0, len(group), BATCH_SIZE):
+                batch = group[start:start + BATCH_SIZE]
+                if len(batch) == 1:
+                    continue
+
+                # Register every ID as in flight, so `convert` waits for the batch instead of requesting it again
+                futures = {identifier: loop.create_future() for identifier in batch}
+                for identifier, future in futures.items():
+                    running[identifier] = future
+                    future.add_done_callback(lambda _, identifier=identifier: running.pop(identifier, None))
+                task = asyncio.ensure_future(PublicationData.request_many(futures))
+                batches.add(task)
+                task.add_done_callback(batches.discard)
+
+        return list(await asyncio.gather(*[PublicationData.convert(identifier) for identifier in identifiers]))
+
+    @staticmethod
+    async def request(identifier: str) -> PublicationData | None:
+        """Request the conversion from the NCBI ID converter, use `convert` instead."""
         try:
-            url = f"https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?tool=biotools-linter&email=251814@mail.muni.cz&ids={identifier}&format=json"
-
-            async with rate_limit:
-                # TODO Move session into singleton (needs to be initialized in async run loop)
-                async with aiohttp.ClientSession(**client_args) as session:
-                    # https://github.com/aio-libs/aiohttp/issues/3203
-                    # AIOHTTP has an issue with timeouts appearing where they shouldn't be.
-                    # Making a new timeout for each request seems to eliminate this issue
-                    response = await session.get(url, ssl=None, timeout=aiohttp.ClientTimeout(total=None,
-                                                                                    sock_connect=15,
-                                                                                    sock_read=15))
-                    result = await response.json()
-
-                    if not result or result.get("status") != "ok":
-                        return None
-
-                    doi = []
-                    pmid = []
-                    pmcid = []
-
-                    for pub in result["records"]:
-                        if pub.get("live") == "false" or pub.get("status") == "error":
-                            return None
-                        
-                        doi.append(pub.get("doi")) if pub.get("doi") is not None else None
-                        pmid.append(pub.get("pmid")) if pub.get("pmid") is not None else None
-                        pmcid.append(pub.get("pmcid")) if pub.get("pmcid") is not None else None
-
-                    pub_data = PublicationData(
-                        doi=doi,
-                        pmid=pmid,
-                        pmcid=pmcid,
-                    )
-                    cache.set(identifier, pub_data)
-                    return pub_data
+            result = await PublicationData.fetch([identifier])
+
+            if not result or result.get("status") != "ok":
+                cache.set(identifier, None)
+                return None
+
+            pub_data = PublicationData.from_records(result["records"])
+            cache.set(identifier, pub_data)
+            return pub_data
 
         except Exception as e:
             logging.critical(
                 f"Error while making API request to idconv for {identifier}: {e}",
             )
             return None
+
+    @staticmethod
+    async def request_many(futures: dict[str, asyncio.Future]) -> None:
+        """Request the conversions of IDs of one type in a single request, use `convert_many` instead.
+
+        Each future gets the conversion of its ID. IDs missing from the answer, or all of them
+        if the request fails, fall back to one request each.
+        """
+        records: dict[str, list[dict]] = {}
+        try:
+            try:
+                result = await PublicationData.fetch(list(futures))
+                if result and result.get("status") == "ok":
+                    for record in result["records"]:
+                        records.setdefault(str(record.get("requested-id", "")).lower(), []).append(record)
+            except Exception as e:
+                logging.critical(
+                    f"Error while making API request to idconv for {len(futures)} IDs: {e}",
+                )
+
+            misses = []
+            for identifier, future in futures.items():
+                if identifier.lower() not in records:
+                    misses.append(identifier)
+                    continue
+
+                # A broken record only fails its own ID, the others are answered as usual
+                try:
+                    pub_data = PublicationData.from_records(records[identifier.lower()])
+                    cache.set(identifier, pub_data)
+                except Exception as e:
+                    logging.critical(f"Error while reading the idconv answer for {identifier}: {e}")
+                    pub_data = None
+                future.set_result(pub_data)
+
+            # The fallback requests are independent, so they run at once within the rate limit
+            results = await asyncio.gather(*[PublicationData.request(identifier) for identifier in misses])
+            for identifier, pub_data in zip(misses, results, strict=True):
+                futures[identifier].set_result(pub_data)
+        except Exception as e:
+            logging.critical(
+                f"Error while reading the idconv answer for {len(futures)} IDs: {e}",
+            )
+        finally:
+            # Callers of `convert` wait on these futures, so none may be left pending, even if this is cancelled
+            for future in futures.values():
+                if not future.done():
+                    future.set_result(None)
+
+    @staticmethod
+    async def fetch(identifiers: list[str]) -> dict | None:
+        """Send the identifiers to the NCBI ID converter and return the decoded answer."""
+        # Passed as params so they are encoded, a DOI may contain characters like & or #
+        params = {
+            "tool": "biotools-linter",
+            "email": "251814@mail.muni.cz",
+            "ids": ",".join(identifiers),
+            "format": "json",
+        }
+        if API_KEY:
+            params["api_key"] = API_KEY
+
+        async with rate_limit:
+            session = get_session()
+            # https://github.com/aio-libs/aiohttp/issues/3203
+            # AIOHTTP has an issue with timeouts appearing where they shouldn't be.
+            # Making a new timeout for each request seems to eliminate this issue
+            # The response is released even if it can't be decoded
+            async with session.get(IDCONV_URL, params=params, ssl=None, timeout=aiohttp.ClientTimeout(total=None,
+                                                                                                 sock_connect=15,
+                                                                                                 sock_read=15)) as response:
+                return await response.json()
+
+    @staticmethod
+    def from_records(records: list[dict]) -> PublicationData | None:
+        """Merge the ID converter records of one identifier, None if any of them is unknown."""
+        doi = []
+        pmid = []
+        pmcid = []
+
+        for pub in records:
+            if pub.get("live") == "false" or pub.get("status") == "error":
+                return None
+
+            doi.append(pub.get("doi")) if pub.get("doi") is not None else None
+            pmid.append(pub.get("pmid")) if pub.get("pmid") is not None else None
+            pmcid.append(pub.get("pmcid")) if pub.get("pmcid") is not None else None
+
+        return PublicationData(
+            doi=doi,
+            pmid=pmid,
+            pmcid=pmcid,
+        )
+
+
+def get_in_flight() -> dict[str, asyncio.Future]:
+    """Return the conversions in flight on the running event loop.
+
+    Lookups left pending by a loop that has since closed are dropped instead of being awaited.
+    """
+    global in_flight, in_flight_loop
+
+    loop = asyncio.get_running_loop()
+    if in_flight_loop is not loop:
+        in_flight = {}
+        in_flight_loop = loop
+
+    return in_flight
+
+
+def clear_cache() -> None:
+    """Forget every conversion, cached or still in flight."""
+    global in_flight
+    cache.clear()
+    # Otherwise results of earlier lookups could still be served
+    in_flight = {}
+
+
+def id_type(identifier: str) -> str:
+    """Guess whether an identifier is a DOI, PMID or PMCID."""
+    if identifier.upper().startswith("PMC"):
+        return "pmcid"
+    if identifier.isdigit():
+        return "pmid"
+    return "doi"
@@ -4,14 +4,17 @@ from __future__ import annotations
 
 import asyncio
 import logging
-import re
+import os
+import time
+from urllib.parse import urlsplit, urlunsplit
 
 import aiohttp
+import orjson
 from cacheout import Cache
 from message import Level, Message
 
 # Initialize (here so it inits once)
-# Now only used by other filters
+# Shared by every request of the URL rule and the publication rule, see `get_session`
 user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.3 (Bio.tools linter, github.com/3top1a/biotools-linter)"
 cache: Cache = Cache(maxsize=2**20, ttl=0, default=None)
 
@@ -25,13 +28,67 @@ client_args = dict(
     timeout=timeout,
     headers={"User-Agent": user_agent},
 )
-
-URL_REGEX = re.compile(
-    r"(http[s]?)://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+"
-)
+# URLs that passed every check and when, can be persisted between runs with `save_good_urls`
+recent_good: dict[str, int] = {}
+# Only set by `load_good_urls`, without a file to save them to passing URLs aren't remembered
+remember_good_urls = False
+# Seconds a URL that passed is trusted without checking it again
+GOOD_URL_TTL = 24 * 60 * 60
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Flaky resets and server errors are retried before they become reports, like the Retry policy lib.py uses
+RETRIES = 2
+RETRY_BACKOFF = 0.3
+RETRY_STATUSES = (500, 502, 503, 504)
+# Seconds a resolved host is kept in the connector's DNS cache, long enough to cover a whole lint run
+DNS_CACHE_TTL = 600
+# The connector and session are bound to the event loop they were created in, so they are created lazily
+connector: aiohttp.TCPConnector | None = None
+connector_loop: asyncio.AbstractEventLoop | None = None
+session: aiohttp.ClientSession | None = None
+session_loop: asyncio.AbstractEventLoop | None = None
+# Maximum number of requests in flight at once, a full run would otherwise open a socket for every URL
+CONCURRENCY = int(os.environ.get("LINTER_URL_CONCURRENCY", "32"))
+semaphore: asyncio.Semaphore | None = None
+semaphore_loop: asyncio.AbstractEventLoop | None = None
+# URLs being checked right now, by canonical form, so concurrent lookups share one request
+# The checks are bound to the event loop they run in, like the session, see `get_in_flight`
+in_flight: dict[str, asyncio.Future] = {}
+in_flight_loop: asyncio.AbstractEventLoop | None = None
+
+URL_SCHEMES = ("http://", "https://")
 REPORT = 15
 # Timeouts cause a lot of slowness in the linter so this value is quite low (the aiohttp default is 5m)
 TIMEOUT = 30
+# Hosts without HTTPS often drop the connection silently instead of refusing it, so don't wait long
+SSL_PROBE_TIMEOUT = 2
+# Message text and severity of every URL check done over the network
+URL_REPORTS: dict[str, tuple[str, Level]] = {
+    "URL_PERMANENT_REDIRECT": ("URL {value} at {key} permanently redirected", Level.ReportLow),
+    "URL_BAD_STATUS": (
+        "URL {value} at {key} returned a non-2xx status code, indicating failure",
+        Level.ReportMedium,
+    ),
+    # Low as it's hard to fix without owning the website
+    "URL_NO_SSL": ("Website {value} at {key} lacks SSL encryption.", Level.ReportLow),
+    # Medium since your browser should auto-upgrade
+    "URL_UNUSED_SSL": ("Website {value} at {key} supports HTTPS but the provided URL uses HTTP.", Level.ReportMedium),
+    # High as it's inaccessible
+    "URL_TIMEOUT": ("Website {value} at {key} took longer than 30 seconds to respond.", Level.ReportHigh),
+    "URL_TOO_MANY_REDIRECTS": (
+        "Encountered excessive or infinite redirects while fetching URL {value} at {key}",
+        Level.ReportHigh,
+    ),
+    "URL_SSL_ERROR": (
+        "Detected an invalid or expired TLS certificate while fetching URL {value} at {key}: {error}",
+        Level.ReportHigh,
+    ),
+    # High as it may not even exist
+    "URL_CONN_ERROR": ("Unable to establish a network connection to the URL {value} at {key}", Level.ReportHigh),
+    "URL_LINTER_ERROR": (
+        "Encountered an unhandled error while validating URL {value} at {key}. Manual review required.\nError:{error}",
+        Level.LinterError,
+    ),
+}
 
 
 async def filter_url(key: str, value: str) -> list[Message] | None:
@@ -54,191 +111,372 @@ async def filter_url(key: str, value: str) -> list[Message] | None:
     """
     global cache
 
+    is_url = looks_like_url(value)
+
+    # Exit if does not match URL or key doesn't end with url/uri
+    if (
+        not is_url
+        and not key.endswith("url")
+        and not key.endswith("uri")
+    ):
+        return None
+
+    logging.debug(f"Checking URL: {value}")
+
+    # Exit if it is a ftp address
+    if value.startswith("ftp://"):
+        logging.debug(
+            f"URL `{value}` points to an ftp server and cannot be checked",
+        )
+        return None
+
+    # If the value doesn't look like a URL but is in a url/uri entry, throw an error
+    # For example, this errors when invisible unicode characters are in the URL
+    if not is_url and (key.endswith(("url", "uri"))):
+        return [
+            Message(
+                "URL_INVALID",
+                f'The URL {value} at {key} could not be parsed, possibly due to invisible Unicode characters',
+                key,
+                Level.ReportHigh,
+            ),
+        ]
+
+    # Equivalent spellings of the same URL share one cache entry
+    # Only computed after the checks above, so whether a value is checked doesn't depend on what was cached before
+    canonical = canonicalize_url(value)
+
     # Check cache
-    if value in cache:
-        hits: list[Message] = cache.get(value)
+    # Only the findings are cached, the messages are made for every key as they include it
+    if canonical in cache:
+        findings = cache.get(canonical)
         logging.debug(
-            f"Cache hit for URL {value} from tool - {len(hits)} messages")
+            f"Cache hit for URL {value} from tool - {len(findings)} messages")
 
-        # Replace keys since those are different
-        for message in hits:
-            message.body = message.body.replace(message.location, key, 1)
-            message.location = key
+        if len(findings) != 0:
+            return make_reports(findings, key, value)
+        return None
 
-        if len(hits) != 0:
-            return hits
+    # Passed on a recent run, don't hit the network again
+    if canonical in recent_good:
+        logging.debug(f"URL {value} passed recently, skipping")
         return None
 
-    # Wrap it in one big try block in case anything errors
+    # The same URL is often under several keys of a tool, only the first one requests it
+    running = get_in_flight()
+    task = running.get(canonical)
+    if task is None:
+        task = asyncio.ensure_future(check_url(canonical, value))
+        running[canonical] = task
+        task.add_done_callback(lambda _: running.pop(canonical, None))
+
+    # Shielded so a cancelled caller doesn't cancel the check for everyone else
+    findings = await asyncio.shield(task)
+
+    if findings:
+        return make_reports(findings, key, value)
+    return None
+
+
+async def check_url(canonical: str, value: str) -> list[tuple[str, str]]:
+    """Probe a URL and remember the findings under its canonical form."""
+    findings = await probe_url(value)
+
+    # Add to cache
+    cache.set(canonical, findings)
+    if not findings and remember_good_urls:
+        recent_good[canonical] = int(time.time())
+
+    return findings
+
+
+async def probe_url(value: str) -> list[tuple[str, str]]:
+    """Request a URL and return what is wrong with it.
+
+    Args:
+    ----
+        value (str): URL
+
+    Returns:
+    -------
+        list[tuple[str, str]]: Codes from `URL_REPORTS` with the error that caused them (or an empty string)
+
+    """
+    findings: list[tuple[str, str]] = []
+
+    # Make a request
+    # It streams it and then closes it so it doesn't download the file. Better than HEAD requests.
     try:
-        reports: list[Message] = []
-
-        # Exit if does not match URL or key doesn't end with url/uri
-        if (
-            not URL_REGEX.match(value)
-            and not key.endswith("url")
-            and not key.endswith("uri")
-        ):
-            return None
-
-        logging.debug(f"Checking URL: {value}")
-
-        # Exit if it is a ftp address
-        if value.startswith("ftp://"):
-            logging.debug(
-                f"URL `{value}` points to an ftp server and cannot be checked",
-            )
-            return None
-
-        # If the URL doesn't match the regex but is in a url/uri entry, throw an error
-        # For example, this errors when invisible unicode characters are in the URL
-        if not URL_REGEX.match(value) and (key.endswith(("url", "uri"))):
-            return [
-                Message(
-                    "URL_INVALID",
-                    f'The URL {value} at {key} could not be parsed, possibly due to invisible Unicode characters',
-                    key,
-                    Level.ReportHigh,
-                ),
-            ]
-
-        # Make a request
-        # It streams it and then closes it so it doesn't download the file. Better than HEAD requests.
-        try:
-            # TODO Move session into singleton (needs to be initialized in async run loop)
-            async with aiohttp.ClientSession(**client_args) as session:
-                # https://github.com/aio-libs/aiohttp/issues/3203
-                # AIOHTTP has an issue with timeouts appearing where they shouldn't be.
-                # Making a new timeout for each request seems to eliminate this issue
-                response = await session.get(value, timeout=aiohttp.ClientTimeout(total=None,
-                                                                                  sock_connect=5,
-                                                                                  sock_read=5))
-                response.close()
-
-                # Check for redirect
-                # See https://docs.aiohttp.org/en/stable/client_advanced.html#redirection-history
-                if len(response.history) != 0:
-                    reports.append(
-                        Message(
-                            "URL_PERMANENT_REDIRECT",
-                            f'URL {value} at {key} permanently redirected',
-                            key,
-                            Level.ReportLow,
+        session = get_session()
+        # https://github.com/aio-libs/aiohttp/issues/3203
+        # AIOHTTP has an issue with timeouts appearing where they shouldn't be.
+        # Making a new timeout for each request seems to eliminate this issue
+        response = await get_with_retries(session, value, timeout=aiohttp.ClientTimeout(total=None,
+                                                                                        sock_connect=5,
+                                                                                        sock_read=5))
+        response.close()
+
+        # Check for redirect
+        # See https://docs.aiohttp.org/en/stable/client_advanced.html#redirection-history
+        if len(response.history) != 0:
+            findings.append(("URL_PERMANENT_REDIRECT", ""))
+
+        # Status is not between 200 and 400
+        if not response.ok:
+            findings.append(("URL_BAD_STATUS", ""))
+
+        if value.startswith("http://"):
+            # Try to request with SSL
+            # Any answer means HTTPS is served, so a HEAD without redirects and a short timeout is enough
+            # The socket timeouts don't cover the TLS handshake, so the whole probe is bounded as well
+            try:
+                async with get_semaphore():
+                    new_response = await asyncio.wait_for(
+                        session.head(
+                            value.replace("http://", "https://", 1),
+                            allow_redirects=False,
+                            timeout=aiohttp.ClientTimeout(total=None,
+                                                          sock_connect=SSL_PROBE_TIMEOUT,
+                                                          sock_read=SSL_PROBE_TIMEOUT),
                         ),
+                        timeout=2 * SSL_PROBE_TIMEOUT,
                     )
+                new_response.close()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                # If it can't connect or nothing answers on the HTTPS port, the site does not use SSL at all
+                findings.append(("URL_NO_SSL", ""))
+            else:
+                # If it succeeds, the site can use SSL but the URL is just wrong
+                findings.append(("URL_UNUSED_SSL", ""))
 
-                # Status is not between 200 and 400
-                if not response.ok:
-                    reports.append(
-                        Message(
-                            "URL_BAD_STATUS",
-                            # f"URL {value} at {key} doesn't return ok status (>399).",
-                            f'URL {value} at {key} returned a non-2xx status code, indicating failure',
-                            key,
-                            Level.ReportMedium,
-                        ),
-                    )
+    # Timeout error>
+    except asyncio.TimeoutError:
+        findings.append(("URL_TIMEOUT", ""))
+
+    except aiohttp.TooManyRedirects:
+        findings.append(("URL_TOO_MANY_REDIRECTS", ""))
 
-                if value.startswith("http://"):
-                    # Try to request with SSL
-                    try:
-                        # Takes extreme amount of time if no such site exists, need to refactor
-                        new_response = await session.get(
-                            value.replace("http://", "https://"),
-                        )
-                        new_response.close()
-                    except aiohttp.ClientConnectorError:
-                        # If it fails with ClientConnectorError, the site does not use SSL at all
-                        reports.append(
-                            Message(
-                                "URL_NO_SSL",
-                                # f"URL {value} at {key} does not use SSL.",
-                                f'Website {value} at {key} lacks SSL encryption.',
-                                key,
-                                Level.ReportLow,
-                            ),
-                        )  # Medium as it's hard to fix without owning the website
-                    else:
-                        # If it succeeds, the site can use SSL but the URL is just wrong
-                        reports.append(
-                            Message(
-                                "URL_UNUSED_SSL",
-                                f'Website {value} at {key} supports HTTPS but the provided URL uses HTTP.',
-                                key,
-                                Level.ReportMedium,
-                            ),
-                        )  # Medium since your browser should auto-upgrade
-
-                await session.close()
-
-        # Timeout error>
-        except asyncio.TimeoutError:
-            reports.append(
-                Message(
-                    "URL_TIMEOUT",
-                    # f"URL {value} at {key} timeouts after {TIMEOUT} seconds.",
-                    f'Website {value} at {key} took longer than 30 seconds to respond.',
-                    key,
-                    Level.ReportHigh,
-                ),
-            )  # High as it's inaccessible
-
-        except aiohttp.TooManyRedirects:
-            # Timeout error
-            reports.append(
-                Message(
-                    "URL_TOO_MANY_REDIRECTS",
-                    # f"URL {value} at {key} failed exceeded 30 redirects.",
-                    f'Encountered excessive or infinite redirects while fetching URL {value} at {key}',
-                    key,
-                    Level.ReportHigh,
-                ),
-            )
-
-        except aiohttp.ClientSSLError as e:
-            # SSL error
-            reports.append(
-                Message(
-                    "URL_SSL_ERROR",
-                    # f"URL {value} at {key} returned an SSL error. ({e})",
-                    f'Detected an invalid or expired TLS certificate while fetching URL {value} at {key}: {e}',
-                    key,
-                    Level.ReportHigh,
-                ),
-            )
-
-        except aiohttp.ClientConnectionError:
-            # Connection error
-            reports.append(
-                Message(
-                    "URL_CONN_ERROR",
-                    # f"URL {value} at {key} returned a connection error, it may not exist.",
-                    f'Unable to establish a network connection to the URL {value} at {key}',
-                    key,
-                    Level.ReportHigh,  # High as it may not even exist
-                ),
-            )
+    except aiohttp.ClientSSLError as e:
+        # SSL error
+        findings.append(("URL_SSL_ERROR", str(e)))
+
+    except aiohttp.ClientConnectionError:
+        # Connection error
+        findings.append(("URL_CONN_ERROR", ""))
 
     except Exception as e:
         # Catch all request error
-        reports.append(
-            Message(
-                "URL_LINTER_ERROR",
-                # f"Error: {e} at {key} while checking {value}",
-                f'Encountered an unhandled error while validating URL {value} at {key}. Manual review required.\nError:{e}',
-                key,
-                Level.LinterError,
-            ),
-        )
+        findings.append(("URL_LINTER_ERROR", str(e)))
 
-    # Add to cache
-    cache.set(value, reports)
+    return findings
 
-    if len(reports) != 0:
-        return reports
-    return None
+
+def make_reports(findings: list[tuple[str, str]], key: str, value: str) -> list[Message]:
+    """Turn the findings of `probe_url` into messages for the given key and URL."""
+    reports = []
+    for code, error in findings:
+        template, level = URL_REPORTS[code]
+        reports.append(Message(code, template.format(value=value, key=key, error=error), key, level))
+    return reports
+
+
+def looks_like_url(value: str) -> bool:
+    """Check if a value is an HTTP(S) URL with a host made of visible characters.
+
+    Invisible Unicode characters (e.g. zero width spaces) in the host make it fail,
+    so they can be reported instead of ending up as connection errors.
+    """
+    if not value.startswith(URL_SCHEMES):
+        return False
+
+    try:
+        netloc = urlsplit(value).netloc
+    except ValueError:
+        return False
+
+    return netloc != "" and netloc.isprintable()
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL for use as a cache key.
+
+    Only differences the server never sees are removed: the case of the scheme and host,
+    default ports and the fragment. The path and query are kept as is, since a trailing
+    slash or parameter order can change the response (e.g. cause a redirect).
+
+    Args:
+    ----
+        url (str): URL, returned unchanged if it can't be parsed
+
+    Returns:
+    -------
+        str: Canonical URL
+
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+
+    if not parts.hostname:
+        return url
+
+    scheme = parts.scheme.lower()
+    host = f"[{parts.hostname}]" if ":" in parts.hostname else parts.hostname
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        host = f"{host}:{port}"
+    userinfo, _, _ = parts.netloc.rpartition("@")
+    netloc = f"{userinfo}@{host}" if userinfo else host
+
+    return urlunsplit((scheme, netloc, parts.path, parts.query, ""))
+
+
+async def get_with_retries(session: aiohttp.ClientSession, url: str, **kwargs: object) -> aiohttp.ClientResponse:
+    """GET a URL, retrying dropped connections and server errors with exponential backoff.
+
+    Connection errors (DNS, refused, SSL) are not retried as they are rarely transient.
+    The last response or error is returned or raised as is.
+    Each attempt takes a slot of the shared semaphore, the backoff doesn't.
+    """
+    for attempt in range(RETRIES + 1):
+        last_attempt = attempt == RETRIES
+        try:
+            async with get_semaphore():
+                response = await session.get(url, **kwargs)
+        except aiohttp.ClientConnectorError:
+            raise
+        except (aiohttp.ServerDisconnectedError, aiohttp.ClientOSError):
+            if last_attempt:
+                raise
+        else:
+            if response.status not in RETRY_STATUSES or last_attempt:
+                return response
+            response.close()
+
+        logging.debug(f"Retrying {url} ({attempt + 1}/{RETRIES})")
+        await asyncio.sleep(RETRY_BACKOFF * 2**attempt)
+
+    # Unreachable, the last attempt always returns or raises
+    raise aiohttp.ClientError(url)
+
+
+def get_connector() -> aiohttp.TCPConnector:
+    """Return the connector shared by all requests on the running event loop.
+
+    Sharing one connector means every host is resolved once and then served from the DNS cache,
+    instead of each request going through the OS resolver again.
+    """
+    global connector, connector_loop
+
+    loop = asyncio.get_running_loop()
+    if connector is None or connector.closed or connector_loop is not loop:
+        # No connection limit, concurrency was never capped when every request had its own connector
+        connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=DNS_CACHE_TTL)
+        connector_loop = loop
+
+    return connector
+
+
+def get_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore that caps concurrent URL requests on the running event loop.
+
+    Set `LINTER_URL_CONCURRENCY` to change the limit.
+    """
+    global semaphore, semaphore_loop
+
+    loop = asyncio.get_running_loop()
+    if semaphore is None or semaphore_loop is not loop:
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        semaphore_loop = loop
+
+    return semaphore
+
+
+def get_in_flight() -> dict[str, asyncio.Future]:
+    """Return the URL checks in flight on the running event loop.
+
+    Checks left pending by a loop that has since closed are dropped instead of being awaited.
+    """
+    global in_flight, in_flight_loop
+
+    loop = asyncio.get_running_loop()
+    if in_flight_loop is not loop:
+        in_flight = {}
+        in_flight_loop = loop
+
+    return in_flight
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the client session shared by all requests on the running event loop.
+
+    The session borrows the shared connector, so open connections and TLS sessions are reused
+    across tools instead of being set up for every URL. Timeouts are passed per request.
+    """
+    global session, session_loop
+
+    loop = asyncio.get_running_loop()
+    if session is None or session.closed or session_loop is not loop:
+        session = aiohttp.ClientSession(connector=get_connector(), connector_owner=False, **client_args)
+        session_loop = loop
+
+    return session
+
+
+async def close_session() -> None:
+    """Close the shared session and connector, call once linting is done."""
+    global connector, connector_loop, session, session_loop
+
+    loop = asyncio.get_running_loop()
+    if session is not None and session_loop is loop:
+        await session.close()
+    if connector is not None and connector_loop is loop:
+        await connector.close()
+    session = None
+    session_loop = None
+    connector = None
+    connector_loop = None
+
+
+def load_good_urls(filename: str) -> None:
+    """Load URLs that passed on previous runs, dropping the ones older than `GOOD_URL_TTL`.
+
+    Also turns on remembering URLs that pass from now on, so `save_good_urls` can save them.
+
+    Args:
+    ----
+        filename (str): File written by `save_good_urls`, ignored if it doesn't exist
+
+    """
+    global recent_good, remember_good_urls
+
+    remember_good_urls = True
+    if not os.path.exists(filename):
+        return
+
+    with open(filename, "rb") as file:
+        saved: dict[str, int] = orjson.loads(file.read())
+
+    now = int(time.time())
+    recent_good = {url: checked for url, checked in saved.items() if now - checked < GOOD_URL_TTL}
+    logging.debug(f"Loaded {len(recent_good)} recently passed URLs from {filename}")
+
+
+def save_good_urls(filename: str) -> None:
+    """Save URLs that passed so the next run can skip them.
+
+    Args:
+    ----
+        filename (str): Output file
+
+    """
+    with open(filename, "wb") as file:
+        file.write(orjson.dumps(recent_good))
 
 
 def clear_cache():
-    global cache
+    global in_flight
     cache.clear()
+    # Otherwise results of earlier checks could still be served
+    in_flight = {}
@@ -3,12 +3,13 @@
 from __future__ import annotations
 
 import datetime
-import json
 import logging
 import os
 import sys
+from pathlib import Path
 
 import lib
+import orjson
 import psycopg2
 from psycopg2.extensions import parse_dsn
 
@@ -49,6 +50,28 @@ SEVERITY_LEVELS = {
 }
 
 
+def migrate(history_file: str, output_file: str) -> int:
+    """Convert an append-only JSONL history into the `{"data": [...]}` JSON the server reads.
+
+    Args:
+    ----
+        history_file (str): JSONL file, one statistics entry per line
+        output_file (str): JSON file to write
+
+    Returns:
+    -------
+        int: Status code
+
+    """
+    with open(history_file, "rb") as jsonl_file:
+        data = {"data": [orjson.loads(line) for line in jsonl_file if line.strip()]}
+
+    Path(output_file).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+
+    logging.info(f"Migrated {len(data['data'])} entries to {output_file}")
+    return 0
+
+
 def main() -> int:
     logging.basicConfig(force=True, level="INFO")
     formatter = logging.Formatter("%(levelname)s - %(message)s")
@@ -58,15 +81,22 @@ def main() -> int:
     root_logger.removeHandler(root_logger.handlers[0])
     root_logger.addHandler(console_handler)
 
+    if len(sys.argv) == 4 and sys.argv[1] == "--migrate":
+        return migrate(sys.argv[2], sys.argv[3])
+
     if len(sys.argv) != 2:
         logging.critical(
             "Please specify output file. Must exist and cannot be blank, only empty JSON.",
         )
         logging.critical("Usage: python linter/statistics.py ~/data.json")
+        logging.critical("       python linter/statistics.py ~/data.jsonl")
+        logging.critical("       python linter/statistics.py --migrate ~/data.jsonl ~/data.json")
         return 1
     output_file = sys.argv[1]
+    # JSONL history is append-only, each run adds a line instead of rewriting the whole file
+    append_only = output_file.endswith(".jsonl")
 
-    if not os.path.exists(output_file):
+    if not append_only and not os.path.exists(output_file):
         with open(output_file, "w") as file:
             file.write('{"data": []}')
 
@@ -93,29 +123,21 @@ def main() -> int:
     unique_tools = cursor.fetchone()[0]
     logging.info(f"Unique tools in DB: {unique_tools}")
 
-    # Count each error
-    def count_error(e: str) -> int:
-        cursor.execute("SELECT COUNT(*) FROM messages where code = %s", (e,))
-        return cursor.fetchone()[0]
-
-    # Count each severity
-    def count_severity(e: str) -> int:
-        cursor.execute("SELECT COUNT(*) FROM messages where level = %s", (e,))
-        return cursor.fetchone()[0]
-
-    # Get error codes
-    error_code_and_count_dict = {}
-    for code in ERROR_TYPES:
-        error_code_and_count_dict[code] = count_error(code)
-        logging.info(f"{code}: {error_code_and_count_dict[code]}")
+    # Get error codes, codes with no messages are left at 0
+    cursor.execute("SELECT code, COUNT(*) FROM messages GROUP BY code")
+    error_code_and_count_dict = dict.fromkeys(ERROR_TYPES, 0)
+    error_code_and_count_dict.update(
+        (code, count) for code, count in cursor.fetchall() if code in error_code_and_count_dict
+    )
+    for code, count in error_code_and_count_dict.items():
+        logging.info(f"{code}: {count}")
 
     # Get severity
-    for sev_id_dict in SEVERITY_LEVELS:
-        SEVERITY_LEVELS[sev_id_dict] = count_severity(SEVERITY_LEVELS[sev_id_dict])
-        logging.info(f"{sev_id_dict}: {SEVERITY_LEVELS[sev_id_dict]}")
-
-    with open(output_file) as json_file:
-        data = json.load(json_file)
+    cursor.execute("SELECT level, COUNT(*) FROM messages GROUP BY level")
+    level_counts = dict(cursor.fetchall())
+    severity_and_count_dict = {name: level_counts.get(level, 0) for name, level in SEVERITY_LEVELS.items()}
+    for name, count in severity_and_count_dict.items():
+        logging.info(f"{name}: {count}")
 
     new_data_entry = {
         "time": time,
@@ -123,13 +145,17 @@ def main() -> int:
         "total_errors": total_errors,
         "unique_tools": unique_tools,
         "error_types": error_code_and_count_dict,
-        "severity": SEVERITY_LEVELS,
+        "severity": severity_and_count_dict,
     }
-    data["data"].append(new_data_entry)
-
-    # Step 3: Save the updated data back to the JSON file
-    with open(output_file, "w") as json_file:
-        json.dump(data, json_file, indent=2)
+    if append_only:
+        with open(output_file, "ab") as jsonl_file:
+            jsonl_file.write(orjson.dumps(new_data_entry) + b"\n")
+    else:
+        data = orjson.loads(Path(output_file).read_bytes())
+        data["data"].append(new_data_entry)
+
+        # Step 3: Save the updated data back to the JSON file
+        Path(output_file).write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
 
     logging.info("Appended to the json file")
     return 0
@@ -1,13 +1,17 @@
 """Fuzzing tests"""
 
-import copy
+import asyncio
 import logging
+import pickle
+from types import MappingProxyType
 
 import pytest
 from lib import Session
 from utils import single_tool_to_search_json
 
-SCHEMA = {
+# Only the top level is read-only, the nested dicts and lists are shared by every variant and must not be modified
+# The linter doesn't modify its input, tests that need to modify SCHEMA work on a full copy (see PICKLED_SCHEMA)
+SCHEMA = MappingProxyType({
     "name": "MSMC",
     "description": "This software implements MSMC, a method to infer population size and gene flow from multiple genome sequences.",
     "homepage": "https://github.com/stschiff/msmc",
@@ -142,9 +146,12 @@ SCHEMA = {
     "validated": 0,
     "homepage_status": 0,
     "elixir_badge": 0,
-}
+})
 
 
+# How many variants are linted at once
+CONCURRENCY = 32
+
 # Check if the linter crashes
 async def check(json):
     json_data = {"x": single_tool_to_search_json(json)}
@@ -153,47 +160,69 @@ async def check(json):
     session.return_tool_list_json()
     await session.lint_all_tools(return_q=None)
 
-def remove_elements(input_dict, collected_dicts=None, path=None):
-    """Recursively navigates through a given dictionary, creating variations of it by removing
-    one key at a time, including keys from nested dictionaries. Each modified dictionary is
-    collected along with the path of removal.
+async def check_all(variants, description):
+    """Check multiple JSONs concurrently, at most `CONCURRENCY` at a time.
+
+    `variants` are (label, json) pairs, `description` is a %-format of the label that is
+    logged before each check and names the variant if it crashes the linter.
+    """
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def guarded_check(label, json):
+        async with semaphore:
+            logging.info(description, label)
+            try:
+                await check(json)
+            except Exception as e:
+                raise AssertionError(f"{description % (label,)} crashed the linter") from e
+
+    await asyncio.gather(*[guarded_check(label, json) for label, json in variants])
+
+def remove_elements(input_dict, path=()):
+    """Yield the path of every key in a dictionary, including keys from nested dictionaries.
+
+    Each path describes one variant of the dictionary with that single key removed, the
+    variant itself is only built when needed by `without_path`.
 
     Parameters
     ----------
-    - input_dict (dict): The original dictionary from which keys will be removed.
-    - collected_dicts (list, optional): A list to collect tuples of modified dictionaries and their
-      removal paths. This parameter is primarily used internally by recursive calls.
-    - path (list, optional): The current path of keys leading to the current dictionary being processed.
+    - input_dict (dict): The original dictionary whose keys will be enumerated.
+    - path (tuple, optional): The current path of keys leading to the current dictionary being processed.
       This parameter is used internally by recursive calls to track the nesting path.
 
     Returns
     -------
-    - list: A list of tuples, where each tuple contains a modified dictionary and the path of keys
-      leading to the removed key. This enables tracking not only the variations but also how each
-      variation was achieved.
+    - generator: Tuples of keys leading to each removable key, parents come before their children.
 
     """
-    if collected_dicts is None:
-        collected_dicts = []
-    if path is None:
-        path = []
+    for key, value in input_dict.items():
+        new_path = (*path, key)
+        yield new_path
 
-    for key in list(input_dict.keys()):
-        # Work on a copy to preserve original dictionary
-        temp_dict = copy.deepcopy(input_dict)
+        # If the value is another dictionary, recurse
+        if isinstance(value, dict):
+            yield from remove_elements(value, new_path)
 
-        # Remove the current key
-        del temp_dict[key]
+def without_path(input_dict, path):
+    """Return a copy of a dictionary with the key at `path` removed.
 
-        # Store the modified dictionary
-        new_path = [*path, key]
-        collected_dicts.append((temp_dict, new_path))
+    Only the dictionaries along `path` are copied, every other value is shared with the
+    original. This is safe because the linter never mutates its input.
 
-        # If the value is another dictionary, recurse
-        if isinstance(input_dict[key], dict):
-            remove_elements(input_dict[key], collected_dicts, new_path)
+    Parameters
+    ----------
+    - input_dict (dict): The original dictionary, left untouched.
+    - path (tuple): Keys leading to the key to remove, as yielded by `remove_elements`.
+
+    Returns
+    -------
+    - dict: The dictionary without the key at `path`.
 
-    return collected_dicts
+    """
+    key, *rest = path
+    if not rest:
+        return {k: v for k, v in input_dict.items() if k != key}
+    return {**input_dict, key: without_path(input_dict[key], rest)}
 
 def replace_values(input_dict, value):
     """Recursively navigates through a given JSON-like dictionary, replacing all values with `None`
@@ -216,32 +245,43 @@ def replace_values(input_dict, value):
       specific needs for differentiating between replaced values.
 
     """
-    for key in input_dict.keys():
-        if isinstance(input_dict[key], dict):
-            # If the value is a dictionary, recurse and then check if it's empty
-            input_dict[key] = replace_values(input_dict[key], value)
-            if not input_dict[key]:  # If the dictionary is now empty, replace it with []
-                input_dict[key] = []
-        else:
-            # Replace non-dictionary values with None
-            input_dict[key] = None
+    # Walk the nested dictionaries with a stack instead of recursion
+    stack = [input_dict]
+    while stack:
+        node = stack.pop()
+        for key, child in node.items():
+            if isinstance(child, dict):
+                # Non-empty dictionaries stay non-empty, so only empty ones are replaced with []
+                if child:
+                    stack.append(child)
+                else:
+                    node[key] = []
+            else:
+                # Replace non-dictionary values with None
+                node[key] = None
     return input_dict
 
+# Unpickling gives a fresh mutable copy of SCHEMA faster than copying it node by node
+PICKLED_SCHEMA = pickle.dumps(dict(SCHEMA), protocol=5)
+
+# SCHEMA never changes, so the removal paths are enumerated once
+VARIANTS = tuple(remove_elements(SCHEMA))
+
 @pytest.mark.asyncio()
 async def test_remove_elements():
 
     # Remove elements
-    for (new_json, x) in remove_elements(SCHEMA):
-        logging.info(f"Removing {x}")
-        await check(new_json)
+    await check_all([(x, without_path(SCHEMA, x)) for x in VARIANTS], "Removing %s")
 
 @pytest.mark.asyncio()
 async def test_replace_values():
+    new_jsons = []
     for x in [None, [], {}]:
-        logging.info(f"Replacing all values with {x}")
-        new_json = replace_values(SCHEMA, x)
+        # replace_values works in place, start every iteration from a fresh copy of SCHEMA
+        new_json = replace_values(pickle.loads(PICKLED_SCHEMA), x)
 
         new_json["name"] = "name"
         new_json["biotoolsID"] = "biotoolsID"
+        new_jsons.append((x, new_json))
 
-        await check(new_json)
+    await check_all(new_jsons, "Replacing all values with %s")
@@ -1,92 +1,51 @@
 """Unit tests. Use with pytest."""
 
 
-import os
-import subprocess
+import asyncio
+import re
 import time
-import pytest
-
-
-@pytest.mark.asyncio
-async def test_session():
-    import lib as lib
-    from lib import flatten_json_to_single_dict
-    import json
-
-    s: lib.Session = lib.Session()
-    import time
+from queue import Queue
+from types import SimpleNamespace
 
-    assert not s.next_page_exists()
-    assert not s.previous_page_exists()
-
-    start_time = time.time()
+import aiohttp
+import cli
+import lib
+import orjson
+import pytest
+import rules
+import rules.publications as publications
+import rules.url as url
+from aioresponses import CallbackResult, aioresponses
+from db import DatabaseConnection
+from message import Level, Message
+from rules.edam import get_edam_filter
+from rules.publications import PublicationData, filter_pub
+from rules.url import canonicalize_url, looks_like_url
+from utils import flatten_json_to_single_dict, sanity_check_json
 
-    # Broad search
-    s.clear_cache()
-    s.search_api("e")
-    assert s.get_total_tool_count() > 1
-    assert s.next_page_exists()
-    assert not s.previous_page_exists()
-    last_json = s.json
 
-    print(f"LIB - Broad: {time.time() - start_time}")
-    start_time = time.time()
+class ListQueue(list):
+    """Lock-free stand-in for Queue, the tests only read messages after linting is done."""
 
-    # Broad search, page 10
-    s.clear_cache()
-    s.search_api("e", 10)
-    assert s.get_total_tool_count() > 1
-    assert s.next_page_exists()
-    assert s.previous_page_exists()
-    assert s.json != last_json
+    put = list.append
 
-    print(f"LIB - Broad p10: {time.time() - start_time}")
-    start_time = time.time()
+    def get(self):
+        return self.pop(0)
 
-    # Exact search
-    s.clear_cache()
-    s.search_api("msmc")
-    assert s.get_total_tool_count() == 1
-    assert not s.next_page_exists()
-    assert not s.previous_page_exists()
 
-    print(f"LIB - exact: {time.time() - start_time}")
-    start_time = time.time()
+@pytest.mark.asyncio
+async def test_session():
+    s: lib.Session = lib.Session()
 
-    # Invalid search
-    s.clear_cache()
-    s.search_api("aaaaaaaaaaaaaaaaaaaaa")
-    assert s.get_total_tool_count() == 0
     assert not s.next_page_exists()
     assert not s.previous_page_exists()
 
-    print(f"LIB - Invalid: {time.time() - start_time}")
-    start_time = time.time()
-
-    # Multiple pages search
-    s.clear_cache()
-    s.search_api_multiple_pages("*", 1, 5 + 1)
-    assert len(s.return_tool_list_json()) == 50
-
-    print(f"LIB - Multiple pages 1: {time.time() - start_time}")
-    start_time = time.time()
-
-    s.clear_cache()
-    s.search_api_multiple_pages("bioto", 1, 5 + 1)
-    assert len(s.return_tool_list_json()) == 2
-
-    print(f"LIB - Multiple pages 2: {time.time() - start_time}")
-    start_time = time.time()
-
     s.clear_cache()
     s.search_api_exact_match("s")
     assert len(s.return_tool_list_json()) == 0
     s.search_api_exact_match("msmc")
     assert len(s.return_tool_list_json()) == 1
 
-    print(f"LIB - Multiple pages 3: {time.time() - start_time}")
-    start_time = time.time()
-
     s.clear_cache()
     for x in range(0, 2):
         s.search_api_multiple_pages("cli", x * 10 + 1, x * 10 + 10 + 1)
@@ -127,17 +86,45 @@ async def test_session():
   ]
 }
 """
-    from queue import Queue
+    q = ListQueue()
+    await s.lint_specific_tool_json(orjson.loads(tool_json), q)
+    assert q.get().code == "URL_BAD_STATUS"
+
+
+def test_flatten_duplicates():
+    # Equal list items still get their own index, and custom separators apply at every level
+    example_json = {"list": ["x", "x", {"y": ["z", "z"]}]}
+    assert flatten_json_to_single_dict(example_json, "root", ".") == {
+        "root.list.0": "x",
+        "root.list.1": "x",
+        "root.list.2.y.0": "z",
+        "root.list.2.y.1": "z",
+    }
 
+
+def test_sanity_check_json():
+    assert not sanity_check_json({"name": "test", "biotoolsID": "test"})
+    assert sanity_check_json({})
+    assert sanity_check_json({"name": "test"})
+    assert sanity_check_json({"name": None, "biotoolsID": "test"})
+    assert sanity_check_json(["name", "biotoolsID"])
+    assert sanity_check_json("name")
+
+
+def test_mock_database():
+    db = DatabaseConnection(None, mock=True)
     q = Queue()
-    await s.lint_specific_tool_json(json.loads(tool_json), q)
-    assert q.get().code == "URL_BAD_STATUS"
+    q.put(Message("LINT-F", "Finished linting", "", level=Level.LinterInternal))
+    assert not db.insert_from_queue(q)
+
+    q.put(Message("LINT-F", "Finished linting", "", level=Level.LinterInternal))
+    q.put(Message("TEST", "test", "test", level=Level.ReportLow))
+    assert db.insert_from_queue(q)
+    assert q.empty()
 
 
 @pytest.mark.asyncio
 async def test_cli():
-    import cli as cli
-
     # "end to end" CLI test, runs the CLI as if it was ran from the command line
     # Any use of certain tool names are only for testing purposes and not in bad faith
     assert await cli.main(["msmc"]) == 0
@@ -146,106 +133,113 @@ async def test_cli():
 
 
 # Test url.py
-@pytest.mark.asyncio
-async def test_urls():
-    # Needs internet access
-    # Also big props to https://httpbin.org, http://httpforever.com and https://httpstat.us
-
-    import rules
-    import time
-
-    start_time = time.time()
-
-    # Ok
-    assert await rules.filter_url("test", "https://httpbin.org/status/200") is None
-
-    print(f"URL - OK: {time.time() - start_time}")
-    start_time = time.time()
-
+# Also big props to https://httpbin.org, http://httpforever.com and https://httpstat.us
+URL_CASES = [
+    pytest.param("test", "https://httpbin.org/status/200", None, id="ok"),
     # Invalid URLs
-    assert await rules.filter_url("test", "ftp://ftp.gnu.org/gnu/") is None
-    assert await rules.filter_url("test", "test") is None
-
-    print(f"URL - Invalid URLs: {time.time() - start_time}")
-    start_time = time.time()
-
-    # URL_INVALID
-    assert (await rules.filter_url("url", "also test"))[0].code == "URL_INVALID"
-
-    print(f"URL - URL_INVALID: {time.time() - start_time}")
-    start_time = time.time()
+    pytest.param("test", "ftp://ftp.gnu.org/gnu/", None, id="ftp"),
+    pytest.param("test", "test", None, id="not_url"),
+    pytest.param("url", "also test", "URL_INVALID", id="URL_INVALID"),
+    pytest.param(
+        "url", "https://gsjdhfskjhfklajshdfkashdfkashdfklashdfjakhsdflkahsfd.sdfsdf", "URL_CONN_ERROR", id="URL_CONN_ERROR",
+    ),
+    pytest.param(
+        "test",
+        "https://httpbin.org/redirect-to?url=https%3A%2F%2Fwww.example.com&status_code=308",
+        "URL_PERMANENT_REDIRECT",
+        id="URL_PERMANENT_REDIRECT",
+    ),
+    pytest.param("test", "https://httpbin.org/status/404", "URL_BAD_STATUS", id="URL_BAD_STATUS"),
+    pytest.param("test", "http://httpbin.org/status/202", "URL_UNUSED_SSL", id="URL_UNUSED_SSL"),
+    pytest.param("test", "http://httpforever.com/", "URL_NO_SSL", id="URL_NO_SSL"),
+    # URL_TIMEOUT - down again?
+    # pytest.param("test", "https://httpstat.us/200?sleep=60000", "URL_TIMEOUT", id="URL_TIMEOUT"),
+    pytest.param("test", "https://expired.badssl.com/", "URL_SSL_ERROR", id="URL_SSL_ERROR"),
+]
 
-    # URL_CONN_ERROR
-    assert (
-        await rules.filter_url(
-            "url", "https://gsjdhfskjhfklajshdfkashdfkashdfklashdfjakhsdflkahsfd.sdfsdf"
-        )
-    )[0].code == "URL_CONN_ERROR"
 
-    print(f"URL - URL_CONN_ERROR: {time.time() - start_time}")
-    start_time = time.time()
+@pytest.mark.integration
+@pytest.mark.parametrize(("key", "value", "code"), URL_CASES)
+@pytest.mark.asyncio
+async def test_urls(key, value, code):
+    # Needs internet access, run with --integration
+    result = await rules.filter_url(key, value)
 
-    # URL_PERMANENT_REDIRECT
-    assert (
-        await rules.filter_url(
-            "test",
-            "https://httpbin.org/redirect-to?url=https%3A%2F%2Fwww.example.com&status_code=308",
-        )
-    )[0].code == "URL_PERMANENT_REDIRECT"
+    if code is None:
+        assert result is None
+    else:
+        assert result[0].code == code
 
-    print(f"URL - URL_PERMANENT_REDIRECT: {time.time() - start_time}")
-    start_time = time.time()
 
-    # URL_BAD_STATUS
-    assert (await rules.filter_url("test", "https://httpbin.org/status/404"))[
-        0
-    ].code == "URL_BAD_STATUS"
+@pytest.mark.asyncio
+async def test_urls_mocked(monkeypatch):
+    # Same rules as test_urls against canned responses, so it runs offline
+    url.clear_cache()
+    monkeypatch.setattr(url, "recent_good", {})
+
+    probes = {
+        "ok": ("test", "https://mock.test/ok"),
+        "URL_TIMEOUT": ("test", "https://mock.test/timeout"),
+        "URL_CONN_ERROR": ("url", "https://mock.test/conn"),
+        "URL_PERMANENT_REDIRECT": ("test", "https://mock.test/redirect"),
+        "URL_BAD_STATUS": ("test", "https://mock.test/404"),
+        "URL_UNUSED_SSL": ("test", "http://mock.test/unused-ssl"),
+        "URL_NO_SSL": ("test", "http://mock.test/no-ssl"),
+        "URL_SSL_ERROR": ("test", "https://mock.test/ssl"),
+    }
 
-    print(f"URL - URL_BAD_STATUS: {time.time() - start_time}")
-    start_time = time.time()
+    ssl_error = aiohttp.ClientSSLError(
+        SimpleNamespace(host="mock.test", port=443, ssl=True), OSError(1, "certificate has expired"),
+    )
+    with aioresponses() as m:
+        m.get("https://mock.test/ok", status=200, repeat=True)
+        m.get("https://mock.test/timeout", exception=asyncio.TimeoutError())
+        m.get("https://mock.test/conn", exception=aiohttp.ClientConnectionError())
+        m.get("https://mock.test/redirect", status=308, headers={"Location": "https://mock.test/ok"})
+        m.get("https://mock.test/404", status=404)
+        m.get("http://mock.test/unused-ssl", status=200)
+        m.head("https://mock.test/unused-ssl", status=200)
+        # Unregistered URLs raise a connection error, so the HTTPS probe for no-ssl fails
+        m.get("http://mock.test/no-ssl", status=200)
+        m.get("https://mock.test/ssl", exception=ssl_error)
+
+        results = dict(zip(probes, await asyncio.gather(*[rules.filter_url(*probe) for probe in probes.values()])))
 
-    # URL_UNUSED_SSL
-    assert (await rules.filter_url("test", "http://httpbin.org/status/202"))[
-        0
-    ].code == "URL_UNUSED_SSL"
+    url.clear_cache()
 
-    print(f"URL - URL_UNUSED_SSL: {time.time() - start_time}")
-    start_time = time.time()
+    assert results.pop("ok") is None
+    for code, result in results.items():
+        assert [message.code for message in result] == [code]
 
-    # URL_NO_SSL
-    # Takes extreme amount of time (33s), need to make it faster
-    assert (await rules.filter_url("test", "http://httpforever.com/"))[
-        0
-    ].code == "URL_NO_SSL"
 
-    print(f"URL - URL_NO_SSL: {time.time() - start_time}")
-    start_time = time.time()
+@pytest.mark.asyncio
+async def test_url_in_flight(monkeypatch):
+    # The same URL under several keys is only requested once, but reported for every key
+    url.clear_cache()
+    monkeypatch.setattr(url, "recent_good", {})
 
-    # URL_TIMEOUT - down again?
-    # assert ((
-    #     await rules.filter_url("test", "https://httpstat.us/200?sleep=60000"))[0].code
-    #     == "URL_TIMEOUT"
-    # )
+    with aioresponses() as m:
+        # Not repeated, a second request would fail with a connection error
+        m.get("https://mock.test/shared", status=404)
 
-    print(f"URL - URL_TIMEOUT: {time.time() - start_time}")
-    start_time = time.time()
+        results = await asyncio.gather(
+            rules.filter_url("tool/homepage", "https://mock.test/shared"),
+            rules.filter_url("tool/link/0/url", "https://mock.test/shared"),
+        )
 
-    # URL_SSL_ERROR
-    assert (await rules.filter_url("test", "https://expired.badssl.com/"))[
-        0
-    ].code == "URL_SSL_ERROR"
+    url.clear_cache()
 
-    print(f"URL - URL_SSL_ERROR: {time.time() - start_time}")
+    assert [[(message.code, message.location) for message in result] for result in results] == [
+        [("URL_BAD_STATUS", "tool/homepage")],
+        [("URL_BAD_STATUS", "tool/link/0/url")],
+    ]
+    assert url.in_flight == {}
 
 
 # Test messages.py
 @pytest.mark.asyncio
 async def test_messages():
-    import rules
-    from message import Message, Level
-    from queue import Queue
-
-    q = Queue()
+    q = ListQueue()
 
     msg = Message(
         code="001", body="Test message", location="//name", level=Level.LinterError
@@ -265,29 +259,76 @@ async def test_messages():
     )
 
 
+@pytest.mark.asyncio
+async def test_publications_batch_failure(monkeypatch):
+    # A batch that fails while reading the answer still answers everyone waiting on it
+    def broken(_records):
+        raise ValueError("broken record")
+
+    monkeypatch.setattr(PublicationData, "from_records", staticmethod(broken))
+    publications.clear_cache()
+    identifiers = ["10.1000/mock&a", "10.1000/mock#b"]
+
+    with aioresponses() as m:
+        m.get(
+            re.compile(r"^https://www\.ncbi\.nlm\.nih\.gov/"),
+            payload={"status": "ok", "records": [{"requested-id": x} for x in identifiers]},
+            repeat=True,
+        )
+        results = await asyncio.wait_for(PublicationData.convert_many(identifiers), timeout=5)
+        [(_, requested)] = m.requests
+
+    assert results == [None, None]
+    # Both IDs are sent in one request, encoded so they don't break the query
+    assert sorted(requested.query["ids"].split(",")) == sorted(identifiers)
+
+
+@pytest.mark.asyncio
+async def test_publications_batch_fallback():
+    # IDs missing from the batch answer are requested on their own
+    publications.clear_cache()
+    identifiers = ["10.1000/mock-a", "10.1000/mock-b", "10.1000/mock-c"]
+
+    def answer(request_url, **kwargs):
+        ids = kwargs["params"]["ids"].split(",")
+        # The batch only knows the first ID
+        known = [x for x in ids if x == identifiers[0] or len(ids) == 1]
+        return CallbackResult(payload={"status": "ok", "records": [{"requested-id": x, "doi": x} for x in known]})
+
+    with aioresponses() as m:
+        m.get(re.compile(r"^https://www\.ncbi\.nlm\.nih\.gov/"), callback=answer, repeat=True)
+        results = await asyncio.wait_for(PublicationData.convert_many(identifiers), timeout=5)
+        requests = [call.kwargs["params"]["ids"] for calls in m.requests.values() for call in calls]
+
+    assert [result.doi for result in results] == [[x] for x in identifiers]
+    [batch] = [ids for ids in requests if "," in ids]
+    assert sorted(batch.split(",")) == identifiers
+    assert sorted(ids for ids in requests if "," not in ids) == identifiers[1:]
+
+
 @pytest.mark.asyncio
 async def test_publications():
-    from rules.publications import PublicationData, filter_pub
-    import json
+    # Test converter, the lookups are independent so they all run at once
+    x1, x2, x3, x4, x5 = await asyncio.gather(
+        PublicationData.convert("10.1093/BIOINFORMATICS/BTAA581"),
+        PublicationData.convert("test"),
+        PublicationData.convert("PMC8034561"),
+        PublicationData.convert(""),
+        PublicationData.convert(None),
+    )
 
-    # Test converter
-    x1: PublicationData = await PublicationData.convert("10.1093/BIOINFORMATICS/BTAA581")
     assert x1
     assert x1.pmid == ["32573681"]
     assert x1.pmcid == ["PMC8034561"]
 
-    x2: PublicationData = await PublicationData.convert("test")
     assert x2 == None
 
-    x3: PublicationData = await PublicationData.convert("PMC8034561")
     assert x3
     assert x3.doi == ["10.1093/bioinformatics/btaa581"]
     assert x3.pmid == ["32573681"]
 
-    x4 = await PublicationData.convert("")
     assert x4 is None
 
-    x5 = await PublicationData.convert(None)
     assert x5 is None
 
     # Test x_BUT_NOT_y
@@ -311,7 +352,7 @@ async def test_publications():
         ]
     }
     """
-    output = await filter_pub(json.loads(json_bad))
+    output = await filter_pub(orjson.loads(json_bad))
     assert len(output) == 2
     assert output[1].code == "DOI_BUT_NOT_PMCID"
     assert output[0].code == "DOI_BUT_NOT_PMID"
@@ -336,7 +377,7 @@ async def test_publications():
         ]
     }
     """
-    output = await filter_pub(json.loads(json_good))
+    output = await filter_pub(orjson.loads(json_good))
     assert output is None
     
     # Test DOI_DISCREPANCY, PMID_DISCREPANCY, PMCID_DISCREPANCY
@@ -360,7 +401,7 @@ async def test_publications():
         ]
     }
     """
-    output = await filter_pub(json.loads(js))
+    output = await filter_pub(orjson.loads(js))
     assert len(output) == 2
     assert output[0].code == "PMID_DISCREPANCY"
     assert output[1].code == "PMCID_DISCREPANCY"
@@ -385,7 +426,7 @@ async def test_publications():
         ]
     }
     """
-    output = await filter_pub(json.loads(js))
+    output = await filter_pub(orjson.loads(js))
     assert len(output) == 4
     # Every ID leads to a different publication
     assert output[0].code == "PMID_DISCREPANCY"
@@ -396,10 +437,7 @@ async def test_publications():
 
 @pytest.mark.asyncio
 async def test_edam():
-    from rules.edam import EdamFilter
-    import json
-
-    f = EdamFilter()
+    f = get_edam_filter()
 
     # EDAM_OBSOLETE
     assert (
@@ -451,16 +489,11 @@ async def test_edam():
     ]
     }"""
 
-    assert len((await f.filter_whole_json(json.loads(input)))) == 3
-    assert (await f.filter_whole_json(json.loads(input)))[
-        0
-    ].code == "EDAM_TOPIC_DISCREPANCY"
-    assert (await f.filter_whole_json(json.loads(input)))[
-        1
-    ].code == "EDAM_INPUT_DISCREPANCY"
-    assert (await f.filter_whole_json(json.loads(input)))[
-        2
-    ].code == "EDAM_OUTPUT_DISCREPANCY"
+    output = await f.filter_whole_json(orjson.loads(input))
+    assert len(output) == 3
+    assert output[0].code == "EDAM_TOPIC_DISCREPANCY"
+    assert output[1].code == "EDAM_INPUT_DISCREPANCY"
+    assert output[2].code == "EDAM_OUTPUT_DISCREPANCY"
 
     input_with_data_format = """
 {
@@ -495,7 +528,7 @@ async def test_edam():
 }
     """
 
-    report = await f.filter_whole_json(json.loads(input_with_data_format))
+    report = await f.filter_whole_json(orjson.loads(input_with_data_format))
     assert len(report) == 1
     assert report[0].code == "EDAM_FORMAT_DISCREPANCY"
 
@@ -503,8 +536,6 @@ async def test_edam():
 @pytest.mark.asyncio
 async def test_url_cache():
     # Tests if the URL cache returns the same results as a uncached result
-    import rules.url as url
-
     url.clear_cache()
 
     clean = await url.filter_url(
@@ -523,20 +554,72 @@ async def test_url_cache():
     assert clean[0].print_message() == x2[0].print_message()
 
 
-def test_lint_all_doesnt_fail():
+@pytest.mark.asyncio
+async def test_url_cache_cold_and_warm(monkeypatch):
+    # A value gets the same result whether or not an equivalent URL was checked before
+    monkeypatch.setattr(url, "recent_good", {})
+
+    probes = [
+        ("tool/description", "HTTPS://MOCK.test/cached"),
+        ("tool/link/0/url", "HTTPS://MOCK.test/cached"),
+        ("tool/homepage", "https://mock.test/cached"),
+    ]
+
+    with aioresponses() as m:
+        m.get("https://mock.test/cached", status=404, repeat=True)
+
+        cold = []
+        for probe in probes:
+            url.clear_cache()
+            cold.append(await rules.filter_url(*probe))
+
+        url.clear_cache()
+        await rules.filter_url("tool/homepage", "https://mock.test/cached")
+        warm = [await rules.filter_url(*probe) for probe in probes]
+
+    url.clear_cache()
+
+    expected = [None, ["URL_INVALID"], ["URL_BAD_STATUS"]]
+    assert [None if result is None else [message.code for message in result] for result in cold] == expected
+    assert [None if result is None else [message.code for message in result] for result in warm] == expected
+
+
+def test_canonicalize_url():
+    assert canonicalize_url("HTTPS://Example.COM:443/Path/?b=1&a=2#top") == "https://example.com/Path/?b=1&a=2"
+    assert canonicalize_url("http://example.com:8080/") == "http://example.com:8080/"
+    assert canonicalize_url("also test") == "also test"
+
+
+def test_looks_like_url():
+    assert looks_like_url("https://example.com/path")
+    assert not looks_like_url("also test")
+    assert not looks_like_url("ftp://ftp.gnu.org/gnu/")
+    assert not looks_like_url("https://")
+    # Hidden unicode in the host
+    assert not looks_like_url("https://exa\u200bmple.com")
+
+
+@pytest.mark.asyncio
+async def test_good_url_cache(tmp_path, monkeypatch):
+    # URLs that passed are persisted and skipped on the next run
+    filename = str(tmp_path / "urls.json")
+    # Loading replaces both, monkeypatch puts back the ones of the session afterwards
+    monkeypatch.setattr(url, "remember_good_urls", False)
+    monkeypatch.setattr(url, "recent_good", {
+        "https://example.org/passed": int(time.time()), "https://example.org/stale": 0,
+    })
+    url.save_good_urls(filename)
+
+    url.load_good_urls(filename)
+    assert "https://example.org/passed" in url.recent_good
+    assert "https://example.org/stale" not in url.recent_good
+    assert await url.filter_url("//test/homepage", "https://example.org/passed") is None
+
+
+@pytest.mark.asyncio
+async def test_lint_all_doesnt_fail():
     """Runs --lint-all and checks if it fails within 10 seconds. If not, it's considered valid."""
-    timeout = 10
-    command = ["python3", os.path.join(os.getcwd(), "linter/cli.py"), "--lint-all", "--no-color"]
-    try:
-        # Start the process
-        start_time = time.time()
-        result = subprocess.run(command, timeout=timeout, capture_output=True, text=True, check=False)
-        end_time = time.time()
-
-        elapsed_time = end_time - start_time
-
-        # Probably impossible for the linter to lint the entire DB in 10s, consider this path a hard fail
-        assert False, result.stderr
-    except subprocess.TimeoutExpired:
-        # If process exceeds the timeout duration, it will raise TimeoutExpired
-        assert True
+    # Runs in-process, so the 10 seconds are spent linting instead of starting an interpreter
+    # Probably impossible for the linter to lint the entire DB in 10s, consider finishing a hard fail
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(cli.main(["--lint-all", "--no-color"]), timeout=10)
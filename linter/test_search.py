@@ -0,0 +1,42 @@
+"""bio.tools API search tests, in their own file so pytest-xdist runs them next to test_lint.py"""
+
+import lib
+import pytest
+
+# A count of None means more than one tool
+SEARCH_CASES = [
+    pytest.param("e", 1, None, True, False, id="broad"),
+    pytest.param("e", 10, None, True, True, id="broad-page-10"),
+    pytest.param("msmc", 1, 1, False, False, id="exact"),
+    pytest.param("aaaaaaaaaaaaaaaaaaaaa", 1, 0, False, False, id="invalid"),
+]
+
+
+@pytest.mark.parametrize(("name", "page", "count", "next_page", "previous_page"), SEARCH_CASES)
+def test_search(name, page, count, next_page, previous_page):
+    s = lib.Session()
+    s.search_api(name, page)
+    if count is None:
+        assert s.get_total_tool_count() > 1
+    else:
+        assert s.get_total_tool_count() == count
+    assert s.next_page_exists() == next_page
+    assert s.previous_page_exists() == previous_page
+
+
+@pytest.mark.parametrize(("name", "tools"), [("*", 50), ("bioto", 2)])
+def test_search_multiple_pages(name, tools):
+    s = lib.Session()
+    s.search_api_multiple_pages(name, 1, 5 + 1)
+    assert len(s.return_tool_list_json()) == tools
+
+
+def test_search_next_page():
+    # Paging has to actually advance, not return the first page again
+    s = lib.Session()
+    s.search_api("e")
+    first_page = s.json
+
+    s.clear_cache()
+    s.search_api("e", 10)
+    assert s.json != first_page
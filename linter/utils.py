@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from collections.abc import Iterator
+
 
 def flatten_json_to_single_dict(
     json_data: dict,
@@ -46,29 +48,30 @@ def flatten_json_to_single_dict(
         None
 
     """
-    out = {}
-
-    if isinstance(json_data, list):
-        for x in json_data:
-            index = json_data.index(x)
-
-            out.update(
-                flatten_json_to_single_dict(
-                    x, f"{parent_key}{separator}{index}"),
-            )
-    elif isinstance(json_data, dict):
-        for key, value in json_data.items():
-            out.update(
-                flatten_json_to_single_dict(
-                    value, f"{parent_key}{separator}{key}"),
-            )
-    else:
-        value = str(json_data)
-        if value == "None":
-            value = None
-        out.update({parent_key: value})
-
-    return out
+    return dict(iterate_flattened_json(json_data, parent_key, separator))
+
+
+def iterate_flattened_json(
+    json_data: dict,
+    parent_key: str = "",
+    separator: str = "/",
+) -> Iterator[tuple[str, str | None]]:
+    """Yield the (key, value) pairs of `flatten_json_to_single_dict` in document order, without building the dict."""
+    # Depth first walk with an explicit stack of (key, node)
+    # Children are pushed in reverse so the output keeps the order of the document
+    stack: list[tuple[str, object]] = [(parent_key, json_data)]
+    while stack:
+        key, node = stack.pop()
+
+        if isinstance(node, list):
+            # The prefix is shared by all children, so it is only concatenated once
+            prefix = key + separator
+            stack.extend((prefix + str(index), x) for index, x in reversed(list(enumerate(node))))
+        elif isinstance(node, dict):
+            prefix = key + separator
+            stack.extend((prefix + str(child), value) for child, value in reversed(node.items()))
+        else:
+            yield key, None if node is None else str(node)
 
 
 def unflatten_json_from_single_dict(flattened_dict: dict, separator: str = "/") -> dict:
@@ -118,9 +121,11 @@ def array_without_value(arr: list, value) -> list:
 
     Returns:
     -------
-        list: Output array
+        list: Output array, `arr` itself if it doesn't contain the value
 
     """
+    if value not in arr:
+        return arr
     return [x for x in arr if x != value]
 
 
@@ -142,12 +147,14 @@ def single_tool_to_search_json(json: str | dict) -> str | dict:
 
 def sanity_check_json(json: dict) -> bool:
     """Sanity check tool JSON. Returns false if correct."""
-    required = ["name", "biotoolsID"]
+    required = ("name", "biotoolsID")
 
-    if json == {} or json == []:
+    # Anything but a non-empty dictionary is not a tool
+    if not json or not isinstance(json, dict):
         return True
 
-    if any(r not in json or not isinstance(r, str) or r is None for r in required):
+    # The values have to be non-empty strings, they are used to name the tool's messages
+    if any(not isinstance(json.get(r), str) or not json[r] for r in required):
         return True
 
     # Reserved space